@@ -7,11 +7,167 @@ import json
 import time
 import os
 import logging
+import socket
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
 from typing import Optional, Tuple, Dict, Any
 
+try:
+    import orjson
+except ImportError:  # orjson为可选依赖，未安装时使用标准库json
+    orjson = None
+
+
+def json_dumps(obj, indent=False):
+    """
+    序列化JSON请求体，优先使用orjson（直接返回bytes，可作为请求体发送）
+    indent为True时缩进2格、保留非ASCII字符，并统一返回UTF-8编码的bytes，用于保存到文件
+    """
+    if orjson is not None:
+        if indent:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+        return orjson.dumps(obj)
+    if indent:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+    return json.dumps(obj)
+
+
+def json_loads(data):
+    """反序列化JSON（支持str和bytes），优先使用orjson"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# 各图片格式对应的MIME类型，键为Pillow的格式名
+IMAGE_MIME_TYPES = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'GIF': 'image/gif', 'WEBP': 'image/webp'}
+
+
+def sniff_image_format(head):
+    """根据文件头的magic bytes识别JPEG/PNG/GIF/WEBP，返回Pillow的格式名，其他格式返回None"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'JPEG'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'PNG'
+    if head.startswith((b'GIF87a', b'GIF89a')):
+        return 'GIF'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+class CachedTimeFormatter(logging.Formatter):
+    """
+    按秒缓存asctime的日志Formatter
+    同一秒内的日志记录复用已格式化的时间字符串，避免每条记录都调用time.strftime
+    """
+
+    def __init__(self, fmt=None, datefmt=None):
+        super(CachedTimeFormatter, self).__init__(fmt, datefmt)
+        # (秒, datefmt, 格式化结果)，整体替换元组，多线程下不会读到不一致的缓存
+        self._time_cache = (None, None, None)
+
+    def formatTime(self, record, datefmt=None):
+        second = int(record.created)
+        cached_second, cached_datefmt, text = self._time_cache
+        if second != cached_second or datefmt != cached_datefmt:
+            text = time.strftime(datefmt or self.default_time_format, self.converter(record.created))
+            self._time_cache = (second, datefmt, text)
+        if datefmt:
+            return text
+        # 默认格式带毫秒，毫秒部分不能缓存
+        return self.default_msec_format % (text, record.msecs)
+
+
+class _KeepAliveAdapter(HTTPAdapter):
+    """
+    为连接池中的socket开启TCP_NODELAY和SO_KEEPALIVE的HTTPAdapter
+    小请求体不会被Nagle算法延迟发送，空闲连接由系统keepalive探测保持可用
+    """
+    # urllib3的默认选项中已包含TCP_NODELAY，这里在其基础上追加SO_KEEPALIVE
+    socket_options = HTTPConnection.default_socket_options + [
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+    ]
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs.setdefault('socket_options', self.socket_options)
+        super(_KeepAliveAdapter, self).init_poolmanager(*args, **kwargs)
+
+
+class _MultipartFileBody(object):
+    """
+    流式读取的multipart/form-data请求体，用于单文件上传
+    文件内容在发送时才从文件对象中分块读取，不会整体载入内存；
+    实现了__len__/tell/seek，requests据此计算Content-Length，urllib3重试时可以回到开头重新发送
+    """
+
+    def __init__(self, fields, name, filename, fileobj, content_type):
+        boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary={}'.format(boundary)
+
+        parts = []
+        for key, value in fields.items():
+            parts.append('--{}\r\nContent-Disposition: form-data; name="{}"\r\n\r\n{}\r\n'.format(
+                boundary, key, value))
+        parts.append('--{}\r\nContent-Disposition: form-data; name="{}"; filename="{}"\r\n'
+                     'Content-Type: {}\r\n\r\n'.format(boundary, name, filename.replace('"', '%22'), content_type))
+        self._head = ''.join(parts).encode('utf-8')
+        self._tail = '\r\n--{}--\r\n'.format(boundary).encode('utf-8')
+
+        self._file = fileobj
+        self._file_start = fileobj.tell()
+        self._file_size = fileobj.seek(0, os.SEEK_END) - self._file_start
+        self._file_end = len(self._head) + self._file_size
+        self._length = self._file_end + len(self._tail)
+        self.seek(0)
+
+    def __len__(self):
+        return self._length
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self._length
+        self._pos = max(0, min(offset, self._length))
+        # 同步文件对象的读取位置，保证read()可以顺序读取
+        file_offset = max(0, min(self._pos - len(self._head), self._file_size))
+        self._file.seek(self._file_start + file_offset)
+        return self._pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._length - self._pos
+        chunks = []
+        while size > 0 and self._pos < self._length:
+            if self._pos < len(self._head):
+                chunk = self._head[self._pos:self._pos + size]
+            elif self._pos < self._file_end:
+                chunk = self._file.read(min(size, self._file_end - self._pos))
+                if not chunk:
+                    raise IOError("File {} is shorter than expected".format(self._file.name))
+            else:
+                offset = self._pos - self._file_end
+                chunk = self._tail[offset:offset + size]
+            chunks.append(chunk)
+            self._pos += len(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+
 class QianfanAppBuilderAPI(object):
     """千帆AppBuilder API的封装类，用于图片理解相关操作"""
     
+    # 接口地址
+    _URL_CONVERSATION = "https://qianfan.baidubce.com/v2/app/conversation"
+    _URL_UPLOAD = _URL_CONVERSATION + "/file/upload"
+    _URL_RUNS = _URL_CONVERSATION + "/runs"
+    
     def __init__(self, app_id, authorization, logger=None, retry_count=3, retry_delay=10):
         """
         初始化千帆AppBuilder API客户端
@@ -21,7 +177,9 @@ class QianfanAppBuilderAPI(object):
             authorization: 认证token
             logger: 外部传入的logger对象，如果为None则使用默认配置
             retry_count: 重试次数，默认3次
-            retry_delay: 重试等待时间（秒），默认10秒
+            retry_delay: 重试退避的基准时间（秒），默认10秒；
+                         第n次重试前等待retry_delay * 2^(n-2)秒（首次重试立即进行），
+                         服务端返回Retry-After时以其为准
         """
         self.app_id = app_id
         self.authorization = authorization
@@ -30,6 +188,28 @@ class QianfanAppBuilderAPI(object):
         self.retry_delay = retry_delay
         # 定义需要重试的错误码组
         self.retry_status_codes = [500, 424]
+        # 请求头只构建一次，各接口直接复用（requests不会修改传入的headers）
+        self._json_headers = {
+            'X-Appbuilder-Authorization': self.authorization,
+            'Content-Type': 'application/json'
+        }
+        self._upload_headers = {
+            'X-Appbuilder-Authorization': self.authorization
+        }
+        # 重试在连接池内部完成：指数退避，并遵循服务端的Retry-After
+        retry = Retry(
+            total=self.retry_count,
+            backoff_factor=self.retry_delay / 2.0,
+            status_forcelist=self.retry_status_codes,
+            allowed_methods=frozenset(['GET', 'POST']),
+            respect_retry_after_header=True,
+            raise_on_status=False  # 重试用尽后返回最后一次的响应，由调用方判断状态码
+        )
+        # 复用同一个Session，避免每次请求都重新建立TCP连接和TLS握手
+        self._pool_maxsize = 32
+        self._session = requests.Session()
+        adapter = _KeepAliveAdapter(pool_connections=8, pool_maxsize=self._pool_maxsize, max_retries=retry)
+        self._session.mount('https://', adapter)
         
         # 使用传入的logger或创建新的logger
         if logger is not None:
@@ -38,7 +218,7 @@ class QianfanAppBuilderAPI(object):
             self.logger = logging.getLogger(__name__)
             if not self.logger.handlers:  # 只有在没有handler时才添加
                 handler = logging.StreamHandler()
-                formatter = logging.Formatter(
+                formatter = CachedTimeFormatter(
                     '[%(asctime)s] - %(levelname)s - %(message)s',
                     datefmt='%Y-%m-%d %H:%M:%S'
                 )
@@ -48,7 +228,7 @@ class QianfanAppBuilderAPI(object):
     
     def _make_request(self, method, url, headers, data=None, files=None):
         """
-        发送HTTP请求，包含重试逻辑
+        发送HTTP请求，重试由Session上挂载的urllib3 Retry完成
         
         Args:
             method: HTTP方法
@@ -60,51 +240,40 @@ class QianfanAppBuilderAPI(object):
         Returns:
             Response对象，失败返回None
         """
-        current_retry = 0
+        try:
+            start_time = time.time()
+            response = self._session.request(method, url, headers=headers, data=data, files=files)
+            elapsed_time = time.time() - start_time
+        except Exception as e:
+            self.log("API call failed after {} retries: {}".format(self.retry_count, str(e)), level='error')
+            return None
         
-        while True:
-            try:
-                start_time = time.time()
-                response = requests.request(method, url, headers=headers, data=data, files=files)
-                elapsed_time = time.time() - start_time
-                
-                if response.status_code in self.retry_status_codes and current_retry < self.retry_count:
-                    current_retry += 1
-                    self.log("API call failed with status code: {}. Retrying ({}/{}) after {} seconds...".format(
-                        response.status_code, current_retry, self.retry_count, self.retry_delay), level='warning')
-                    time.sleep(self.retry_delay)
-                    continue
-                
-                if response.status_code != 200:
-                    self.log("API call failed with status code: {}. Elapsed time: {:.2f} seconds".format(
-                        response.status_code, elapsed_time), level='error')
-                else:
-                    self.log("API call successful. Elapsed time: {:.2f} seconds".format(elapsed_time))
-                
-                return response
-                
-            except Exception as e:
-                if current_retry < self.retry_count:
-                    current_retry += 1
-                    self.log("API call failed with error: {}. Retrying ({}/{}) after {} seconds...".format(
-                        str(e), current_retry, self.retry_count, self.retry_delay), level='warning')
-                    time.sleep(self.retry_delay)
-                else:
-                    self.log("API call failed after {} retries: {}".format(self.retry_count, str(e)), level='error')
-                    return None
+        if response.status_code != 200:
+            self.log("API call failed with status code: {}. Elapsed time: {:.2f} seconds".format(
+                response.status_code, elapsed_time), level='error')
+        else:
+            self.log("API call successful. Elapsed time: {:.2f} seconds".format(elapsed_time))
+        
+        return response
     
+    def close(self):
+        """关闭底层Session，释放连接池中的连接"""
+        self._session.close()
+
     def log(self, message, level='info'):
         """
         输出日志信息
         
         Args:
             message: 日志消息
-            level: 日志级别，默认info
+            level: 日志级别（error/warning/info/debug），默认info
         """
         if level == 'error':
             self.logger.error(message)
         elif level == 'warning':
             self.logger.warning(message)
+        elif level == 'debug':
+            self.logger.debug(message)
         else:
             self.logger.info(message)
 
@@ -116,18 +285,13 @@ class QianfanAppBuilderAPI(object):
             str: 成功返回conversation_id，失败返回None
         """
         try:
-            url = "https://qianfan.baidubce.com/v2/app/conversation"
-            headers = {
-                "X-Appbuilder-Authorization": self.authorization,
-                'Content-Type': 'application/json'
-            }
-            payload = json.dumps({
+            payload = json_dumps({
                 "app_id": self.app_id
             })
             
-            response = self._make_request("POST", url, headers=headers, data=payload)
+            response = self._make_request("POST", self._URL_CONVERSATION, headers=self._json_headers, data=payload)
             if response and response.status_code == 200:
-                self.conversation_id = response.json().get("conversation_id")
+                self.conversation_id = json_loads(response.content).get("conversation_id")
                 self.log("Created new conversation with ID: {}".format(self.conversation_id))
                 return self.conversation_id
             else:
@@ -155,11 +319,6 @@ class QianfanAppBuilderAPI(object):
             start_time = time.time()
             self.log('Starting file upload...')
             
-            url = "https://qianfan.baidubce.com/v2/app/conversation/file/upload"
-            headers = {
-                'X-Appbuilder-Authorization': self.authorization
-            }
-            
             if self.conversation_id:
                 payload = {
                     'app_id': self.app_id,
@@ -170,16 +329,22 @@ class QianfanAppBuilderAPI(object):
                     'app_id': self.app_id
                 }
                 
-            files = [
-                ('file', (file.name.split('/')[-1], file, 'image/png'))
-            ]
+            # 根据文件头确定Content-Type，无法识别时按原来的image/png上传
+            position = file.tell()
+            content_type = IMAGE_MIME_TYPES.get(sniff_image_format(file.read(12)), 'image/png')
+            file.seek(position)
+
+            # 流式发送multipart请求体，文件内容不会被整体读入内存
+            body = _MultipartFileBody(payload, 'file', os.path.basename(file.name), file, content_type)
+            headers = dict(self._upload_headers)
+            headers['Content-Type'] = body.content_type
             
-            response = self._make_request("POST", url, headers=headers, data=payload, files=files)
+            response = self._make_request("POST", self._URL_UPLOAD, headers=headers, data=body)
             end_time = time.time()
             elapsed_time = end_time - start_time
             
             if response and response.status_code == 200:
-                result = response.json()
+                result = json_loads(response.content)
                 if result.get('conversation_id'):
                     self.conversation_id = result.get('conversation_id')
                     self.log('Got new conversation ID from upload: {}'.format(self.conversation_id))
@@ -212,12 +377,6 @@ class QianfanAppBuilderAPI(object):
             start_time = time.time()
             self.log('Starting API call...')
             
-            url = "https://qianfan.baidubce.com/v2/app/conversation/runs"
-            headers = {
-                'Content-Type': 'application/json',
-                'X-Appbuilder-Authorization': self.authorization
-            }
-            
             payload_dict = {
                 "app_id": self.app_id,
                 "query": query,
@@ -228,15 +387,15 @@ class QianfanAppBuilderAPI(object):
             if file_id:
                 payload_dict["file_ids"] = [file_id]
                 
-            payload = json.dumps(payload_dict)
+            payload = json_dumps(payload_dict)
             
-            response = self._make_request("POST", url, headers=headers, data=payload)
+            response = self._make_request("POST", self._URL_RUNS, headers=self._json_headers, data=payload)
             end_time = time.time()
             elapsed_time = end_time - start_time
             
             if response and response.status_code == 200:
                 self.log('API call completed in {:.2f} seconds'.format(elapsed_time))
-                return response.json()
+                return json_loads(response.content)
             else:
                 return None
                 
@@ -244,6 +403,37 @@ class QianfanAppBuilderAPI(object):
             self.log("Error in API call: {}".format(str(e)), level='error')
             return None
 
+    def run_app_api_batch(self, queries, file_ids=None, max_workers=8):
+        """
+        批量调用应用API，多个查询在同一会话内并发执行，共用连接池中的连接
+        
+        Args:
+            queries: 查询文本列表
+            file_ids: 与queries一一对应的文件ID列表，可选
+            max_workers: 最大并发数，默认8，不超过连接池大小（32）
+            
+        Returns:
+            List[Dict]: 与queries顺序一致的API响应结果，单个查询失败时对应位置为None；
+                        参数错误或创建会话失败时返回None
+        """
+        if file_ids is None:
+            file_ids = [None] * len(queries)
+        if len(file_ids) != len(queries):
+            self.log("Length of file_ids ({}) does not match queries ({})".format(
+                len(file_ids), len(queries)), level='error')
+            return None
+        
+        # 提前创建会话，避免多个线程同时创建
+        if not self.conversation_id:
+            if not self.create_conversation():
+                return None
+        
+        # 并发数不超过连接池大小，保证每个连接用完后都能放回池中被后续请求复用，
+        # 而不是池满后被丢弃、下次再重新握手
+        max_workers = min(max_workers, self._pool_maxsize)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(self.run_app_api, queries, file_ids))
+
     def get_status(self):
         """
         获取当前实例的状态信息，用于调试
@@ -256,7 +446,9 @@ class QianfanAppBuilderAPI(object):
             "authorization": "***{}".format(self.authorization[-8:]),  # 只显示末尾几位
             "conversation_id": self.conversation_id
         }
-        self.log("Current status: {}".format(json.dumps(status, indent=2)))
+        # 状态只在DEBUG级别输出，未开启时跳过格式化
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.log("Current status: {}".format(json.dumps(status, indent=2)), level='debug')
         return status
 
 
@@ -265,7 +457,7 @@ def main():
     # 配置日志（这里仅作为示例，实际使用时可以使用外部的日志配置）
     logger = logging.getLogger("qianfan_example")
     handler = logging.StreamHandler()
-    formatter = logging.Formatter(
+    formatter = CachedTimeFormatter(
         '[%(asctime)s] - %(name)s - %(levelname)s - %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S'
     )
@@ -12,19 +12,83 @@ import requests
 import os
 import logging
 import PIL
-from PIL import Image
+from PIL import Image, features
 import sys
 import re
-from appBuilder_api import QianfanAppBuilderAPI
+import io
+import shutil
+import sqlite3
+import hashlib
+import time
+import threading
+import queue
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+from urllib3.util.retry import Retry
+from appBuilder_api import QianfanAppBuilderAPI, CachedTimeFormatter, sniff_image_format, json_dumps, json_loads
+
+try:
+    import numpy
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJPF_RGBA, TJPF_RGBX, TJSAMP_420
+    # 全局复用一个TurboJPEG实例，避免每张图片重复加载libturbojpeg
+    _turbo_jpeg = TurboJPEG()
+    # 可由libturbojpeg直接编码的Pillow图片模式，RGBA/RGBX的第4通道在编码时被忽略，无需先转换为RGB
+    _TURBO_PIXEL_FORMATS = {'RGB': TJPF_RGB, 'RGBA': TJPF_RGBA, 'RGBX': TJPF_RGBX}
+except (ImportError, OSError, RuntimeError):
+    # PyTurboJPEG为可选依赖，未安装或找不到libturbojpeg时使用Pillow编码JPEG
+    _turbo_jpeg = None
+    _TURBO_PIXEL_FORMATS = {}
+
+# 无需转换、原样保存的图片格式（Pillow的格式名只有'JPEG'，没有'JPG'）及其扩展名
+_PASSTHROUGH_FORMATS = frozenset({'JPEG', 'PNG'})
+_PASSTHROUGH_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png'}
+
+# 替换图片标记时，放在图片理解结果前的说明文字
+_DESCRIBE_PREFIX = '这是一张图片，通过markdown格式json语法代码块输出图片内容如下：'
+
+# 提取图片理解结果中的json代码块
+_JSON_BLOCK_RE = re.compile(r'```json\s*(.*?)```', re.DOTALL)
+
+
+_WHITESPACE_RE = re.compile(r'\s')
+
+def _looks_like_url(value):
+    """快速判断字符串是否可能是URL：过长、含空白或不以http(s)开头的字符串（如正文内容）直接排除"""
+    return (len(value) <= 2048 and value.startswith(('http://', 'https://'))
+            and not _WHITESPACE_RE.search(value))
+
+def _format_path(path):
+    """将路径元组格式化为便于阅读的字符串，如('foo', 'bar', 3) -> 'foo.bar[3]'，仅用于日志"""
+    parts = []
+    for key in path:
+        if isinstance(key, int):
+            parts.append("[{}]".format(key))
+        else:
+            parts.append(".{}".format(key) if parts else key)
+    return ''.join(parts)
+
+def _set_by_path(root, path, value):
+    """按路径元组设置嵌套字典/列表中的值"""
+    node = root
+    for key in path[:-1]:
+        node = node[key]
+    node[path[-1]] = value
 
 class ImageProcessor:
     """
     图片处理类"""
+    # 下载图片的超时时间：(连接超时, 读取超时)，单位秒
+    download_timeout = (3.05, 30)
+
     def __init__(self, app_id, authorization, logger=None, 
                  image_links_path=['page_info', 'image_links'],
                  min_size_kb=30,
                  valid_response_key=None,
-                 image_save_dir=None, retry_count=2, retry_delay=5):
+                 image_save_dir=None, retry_count=2, retry_delay=5,
+                 download_workers=16, use_cache=False, max_concurrent_understanding=8,
+                 cache_ttl=7 * 24 * 3600, cache_version=''):
         """
         初始化图片处理器
         :param app_id: 千帆API的app_id
@@ -34,107 +98,369 @@ class ImageProcessor:
         :param min_size_kb: 图片最小大小，单位为KB，默认为30
         :param valid_response_key: 模型返回结果中判断有效性的键名，如果为None则不进行有效性检查
         :param image_save_dir: 图片保存目录，如果为None则使用当前目录下的'images'文件夹
+        :param download_workers: 并发下载图片的最大线程数，默认为16
+        :param use_cache: 是否按图片内容缓存图片理解结果，缓存保存在image_save_dir下的.ans_cache.sqlite3中，默认为False
+        :param max_concurrent_understanding: 并发调用图片理解API的最大线程数，默认为8
+        :param cache_ttl: 缓存结果的有效期，单位为秒，默认为7天；为None时不过期
+        :param cache_version: 缓存版本号，参与计算缓存key；修改服务端应用的prompt后更换版本号即可让旧缓存失效
         """
         self.logger = logger or self._setup_logger()
 
         self.api_client = QianfanAppBuilderAPI(app_id, authorization, self.logger, retry_count, retry_delay)
+        # api_client会保存conversation_id，不能被多个线程同时使用；按并发数创建一组客户端，
+        # 每次调用从空闲队列中取出一个，用完放回，各客户端的连接池在多次process_content之间复用
+        self.max_concurrent_understanding = max(1, max_concurrent_understanding)
+        self._api_clients = [self.api_client] + [
+            QianfanAppBuilderAPI(app_id, authorization, self.logger, retry_count, retry_delay)
+            for _ in range(self.max_concurrent_understanding - 1)
+        ]
+        self._idle_api_clients = queue.Queue()
+        for client in self._api_clients:
+            self._idle_api_clients.put(client)
         self.image_links_path = image_links_path
         self.min_size_bytes = min_size_kb * 1024
         self.valid_response_key = valid_response_key
+        self.download_workers = download_workers
+        self.convert_workers = os.cpu_count() or 1
+        # 所有图片下载共用一个Session，复用到同一图床的keep-alive连接；
+        # 连接池不小于下载并发数，连接失败和5xx由Retry自动重试
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=max(32, download_workers),
+            max_retries=Retry(total=retry_count, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
+        )
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
         
         # 设置并创建图片保存目录
         self.image_save_dir = image_save_dir or os.path.join(os.getcwd(), 'images')
         os.makedirs(self.image_save_dir, exist_ok=True)
-        self.logger.info("Images will be saved to: {}".format(self.image_save_dir))
+        self.logger.info("Images will be saved to: %s", self.image_save_dir)
+
+        # 图片理解结果缓存，key为app_id、缓存版本号、query和图片内容的sha256；
+        # 使用sqlite3（WAL模式）保存，多个进程可以共用同一个缓存文件
+        self.cache_ttl = cache_ttl
+        self.cache_version = cache_version
+        self._cache_path = os.path.join(self.image_save_dir, '.ans_cache.sqlite3')
+        self._cache_lock = threading.Lock()
+        self._cache_conn = self._open_cache() if use_cache else None
+        self.use_cache = self._cache_conn is not None
         
         # 记录有效性检查配置
         if self.valid_response_key:
-            self.logger.info("Validity check enabled with key: {}".format(self.valid_response_key))
+            self.logger.info("Validity check enabled with key: %s", self.valid_response_key)
         else:
             self.logger.info("Validity check disabled")
 
+        # JPEG转换的速度取决于Pillow链接的是libjpeg还是libjpeg-turbo
+        if not features.check_feature('libjpeg_turbo'):
+            self.logger.warning("Pillow is not built with libjpeg-turbo, JPEG conversion will be slower")
+
+    def close(self):
+        """关闭图片下载和API客户端复用的Session，释放连接池中的连接，并关闭缓存数据库"""
+        self._session.close()
+        for client in self._api_clients:
+            client.close()
+        if self._cache_conn is not None:
+            with self._cache_lock:
+                self.use_cache = False
+                self._cache_conn.close()
+                self._cache_conn = None
+
     def _setup_logger(self):
         """设置默认logger"""
         logger = logging.getLogger('ImageProcessor')
         if not logger.handlers:
             handler = logging.StreamHandler()
-            formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+            formatter = CachedTimeFormatter('%(asctime)s - %(levelname)s - %(message)s')
             handler.setFormatter(formatter)
             logger.addHandler(handler)
-            logger.setLevel(logging.DEBUG)  # 修改为DEBUG级别
+            logger.setLevel(logging.INFO)
         return logger
 
-    def _get_image_format(self, image_path):
-        """获取图片格式"""
+    def _convert_to_jpg(self, source, target_path):
+        """
+        转换图片为JPG格式
+        :param source: 图片文件路径，或包含原始图片数据的文件对象
+        :param target_path: 转换后JPG文件的保存路径
+        :return: (是否成功, 转换后的文件路径)
+        """
+        # 能从文件头识别出格式时，只让Pillow尝试对应的解码插件
+        formats = None
+        if hasattr(source, 'read'):
+            image_format = sniff_image_format(source.read(12))
+            source.seek(0)
+            if image_format:
+                formats = (image_format,)
         try:
-            with Image.open(image_path) as img:
-                self.logger.info("Image {} - Format: {}".format(image_path, img.format))
-                return img.format
+            with Image.open(source, formats=formats) as img:
+                self.logger.info("Image %s - Format: %s", target_path, img.format)
+                self._save_jpeg(img, target_path)
         except IOError:
-            self.logger.error("Cannot open {}. It may not be a valid image file.".format(image_path))
-            return None
-
-    def _convert_to_jpg(self, source_file_path, target_file_path):
-        """转换图片为JPG格式"""
-        filename = os.path.basename(source_file_path)
-        image_format = self._get_image_format(source_file_path)
-        
-        if not image_format:
-            self.logger.error("Unable to determine the image format of {}".format(filename))
+            self.logger.error("Cannot convert image to %s. Unsupported image format or corrupted file.",
+                target_path)
             return False, None
 
-        if image_format in ['JPEG', 'JPG', 'PNG']:
-            return True, source_file_path
+        self.logger.info("Converted image to JPG format: %s", target_path)
+        return True, target_path
+
+    def _save_jpeg(self, img, target_path):
+        """将图片编码为JPEG，优先由libturbojpeg直接编码Pillow的像素数组，失败时回退到Pillow"""
+        # RGBA/RGBX可由libturbojpeg直接编码，不先convert('RGB')，比转换后再编码少一次整图拷贝
+        if img.mode != 'RGB' and img.mode not in _TURBO_PIXEL_FORMATS:
+            img = img.convert('RGB')
+        pixel_format = _TURBO_PIXEL_FORMATS.get(img.mode)
+        if pixel_format is not None:
+            try:
+                # numpy.asarray通过Image.__array_interface__调用tobytes()，会拷贝一次像素数据；
+                # 与Pillow默认参数保持一致：quality=75，4:2:0采样
+                jpeg_bytes = _turbo_jpeg.encode(numpy.asarray(img), quality=75,
+                                                pixel_format=pixel_format, jpeg_subsample=TJSAMP_420)
+            except OSError as e:
+                self.logger.warning("libturbojpeg failed to encode %s, falling back to Pillow: %s",
+                    target_path, e)
+            else:
+                with open(target_path, 'wb') as f:
+                    f.write(jpeg_bytes)
+                return
+
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.save(target_path, "JPEG")
+
+    def _download_image(self, url, base_path):
+        """
+        下载单张图片
+        根据响应开头的magic bytes判断格式：JPEG/PNG以流式方式直接写入磁盘；
+        其他格式需要转换，原始数据只保留在内存中，转换后只写一次JPG，不落盘原始文件
+        :param base_path: 不含扩展名的保存路径
+        :return: (文件路径, 待转换的原始数据)，无需转换时原始数据为None；
+                 图片小于最小大小或响应不是图片时返回None，不保留文件
+        """
+        with self._session.get(url, stream=True, timeout=self.download_timeout) as response:
+            response.raise_for_status()
+            # 响应头中的Content-Length已经小于最小大小时，不再下载响应体
+            content_length = response.headers.get('Content-Length')
+            if (content_length and content_length.isdigit() and 'Content-Encoding' not in response.headers
+                    and int(content_length) < self.min_size_bytes):
+                self.logger.info("Skip small image %s (%s bytes)", url, content_length)
+                return None
+            # 图床出错时可能以200返回HTML等文本页面，不下载响应体，也不交给Pillow解析
+            content_type = response.headers.get('Content-Type', '')
+            if content_type.startswith('text/'):
+                self.logger.warning("Skip non-image response %s (Content-Type: %s)", url, content_type)
+                return None
+            # 按Content-Encoding解压，保证拿到的是原始图片数据
+            response.raw.decode_content = True
+            head = response.raw.read(64 * 1024)
+            image_format = sniff_image_format(head)
 
+            if image_format in _PASSTHROUGH_FORMATS:
+                file_path = base_path + _PASSTHROUGH_EXTENSIONS[image_format]
+                try:
+                    with open(file_path, 'wb') as f:
+                        self._preallocate(f, response.headers.get('Content-Length'))
+                        f.write(head)
+                        shutil.copyfileobj(response.raw, f, 64 * 1024)
+                        # 解压后的实际大小可能与Content-Length不同，截断到实际写入的长度
+                        f.truncate()
+                        size = f.tell()
+                except Exception:
+                    # 下载中断时删除写了一半的文件
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+                    raise
+                # 没有Content-Length时只能下载后再按实际大小过滤
+                if size < self.min_size_bytes:
+                    os.remove(file_path)
+                    self.logger.info("Skip small image %s (%s bytes)", url, size)
+                    return None
+                return file_path, None
+
+            buffer = io.BytesIO()
+            buffer.write(head)
+            shutil.copyfileobj(response.raw, buffer, 64 * 1024)
+            if buffer.tell() < self.min_size_bytes:
+                self.logger.info("Skip small image %s (%s bytes)", url, buffer.tell())
+                return None
+            buffer.seek(0)
+            return base_path + '.jpg', buffer
+
+    def _preallocate(self, f, content_length):
+        """按Content-Length一次性预分配文件空间，减少磁盘碎片；不支持时直接跳过"""
+        if not content_length or not hasattr(os, 'posix_fallocate'):
+            return
         try:
-            with Image.open(source_file_path) as img:
-                target_path = os.path.join(target_file_path, "{}.jpg"\
-                    .format(os.path.splitext(filename)[0]))
-                rgb_im = img.convert('RGB')
-                rgb_im.save(target_path, "JPEG")
-                self.logger.info("Converted {} to JPG format.".format(source_file_path))
-                os.remove(source_file_path)
-                self.logger.info("Deleted original file {}.".format(source_file_path))
-                return True, target_path
-        except IOError:
-            self.logger.error("Cannot convert {}. Unsupported image format or corrupted file."\
-                .format(source_file_path))
-            return False, None
+            os.posix_fallocate(f.fileno(), 0, int(content_length))
+        except (OSError, ValueError) as e:
+            self.logger.debug("Skip preallocation for %s: %s", f.name, e)
+
+    def _download_all(self, targets):
+        """
+        并发下载多张图片
+        :param targets: {标识: (url, 不含扩展名的保存路径)}
+        :return: {标识: (文件路径, 待转换的原始数据)}，按targets的顺序排列，下载失败或过小的图片不包含在内，
+                 单张图片失败不影响其他图片
+        """
+        downloaded = {}
+        with ThreadPoolExecutor(max_workers=self.download_workers) as executor:
+            futures = {}
+            for name, (url, base_path) in targets.items():
+                futures[name] = (url, executor.submit(self._download_image, url, base_path))
+
+            for name, (url, future) in futures.items():
+                try:
+                    result = future.result()
+                # 直接读取response.raw时，连接中断、读超时由urllib3抛出，不会被包装成RequestException
+                except (requests.RequestException, Urllib3HTTPError, OSError) as e:
+                    self.logger.warning("Failed to download image %s from %s: %s", name, url, e)
+                    continue
+                except Exception as e:
+                    # 单张图片的其他异常（如磁盘写入失败）只记录日志，不影响其他图片
+                    self.logger.error("Error downloading image %s from %s: %s", name, url, e)
+                    continue
+                if result is not None:
+                    downloaded[name] = result
+        return downloaded
 
     def _download_images(self, image_links, key):
-        """下载图片并转换格式"""
-        saved_files = {}
+        """
+        下载图片并转换格式
+        分两个阶段：先并发下载全部图片（I/O密集），再并发完成格式转换（CPU密集，Pillow编解码时会释放GIL）
+        """
+        # 第一阶段：并发下载
+        targets = {}
         for index, url in image_links.items():
-            try:
-                response = requests.get(url)
-                response.raise_for_status()
-                
-                file_path = os.path.join(self.image_save_dir, "{}_{}.png".format(key, index))
-                with open(file_path, 'wb') as f:
-                    f.write(response.content)
-                    
-                status, converted_path = self._convert_to_jpg(file_path, self.image_save_dir)
+            targets[index] = (url, os.path.join(self.image_save_dir, "{}_{}".format(key, index)))
+        downloaded = self._download_all(targets)
+
+        # 第二阶段：并发转换格式，JPEG/PNG已在下载时原样落盘
+        saved_files = {}
+        with ThreadPoolExecutor(max_workers=self.convert_workers) as executor:
+            futures = {}
+            for index, (file_path, buffer) in downloaded.items():
+                if buffer is None:
+                    futures[index] = None
+                else:
+                    futures[index] = executor.submit(self._convert_to_jpg, buffer, file_path)
+
+            for index, future in futures.items():
+                if future is None:
+                    status, converted_path = True, downloaded[index][0]
+                else:
+                    try:
+                        status, converted_path = future.result()
+                    except Exception as e:
+                        # 解码炸弹、内存不足等非IOError异常只跳过这一张图片，并删除可能写了一半的文件
+                        self.logger.error("Error converting image %s: %s", index, e)
+                        file_path = downloaded[index][0]
+                        if os.path.exists(file_path):
+                            os.remove(file_path)
+                        continue
                 if status:
                     saved_files[index] = os.path.abspath(converted_path)
-                    self.logger.info("Image {} downloaded and saved as {}".format(index, converted_path))
-            except requests.RequestException as e:
-                self.logger.warning("Failed to download image {} from {}: {}".format(index, url, e))
+                    self.logger.info("Image %s downloaded and saved as %s", index, converted_path)
         return saved_files
 
-    def _call_image_understanding(self, image_path):
-        """调用图片理解API"""
+    def _open_cache(self):
+        """打开缓存数据库并清理过期结果，失败时记录warning并禁用缓存"""
         try:
-            with open(image_path, 'rb') as file:
+            conn = sqlite3.connect(self._cache_path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS results '
+                         '(key TEXT PRIMARY KEY, result BLOB NOT NULL, created_at REAL NOT NULL)')
+            if self.cache_ttl is not None:
+                conn.execute('DELETE FROM results WHERE created_at < ?', (time.time() - self.cache_ttl,))
+            conn.commit()
+            return conn
+        except sqlite3.Error as e:
+            self.logger.warning("Failed to open image understanding cache %s, cache disabled: %s",
+                self._cache_path, e)
+            return None
+
+    def _cache_key(self, image_path, query):
+        """根据app_id、缓存版本号、query和图片内容计算缓存key"""
+        sha = hashlib.sha256()
+        sha.update("{}\0{}\0{}\0".format(self.api_client.app_id, self.cache_version, query).encode('utf-8'))
+        with open(image_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def _cache_lookup(self, image_path, query):
+        """
+        查询缓存，缓存不可用（数据库被锁、损坏等）时只记录warning，继续调用API
+        :return: (缓存key, 缓存的结果)，未命中或已过期时结果为None，出错时均为None
+        """
+        try:
+            cache_key = self._cache_key(image_path, query)
+            with self._cache_lock:
+                row = self._cache_conn.execute(
+                    'SELECT result, created_at FROM results WHERE key = ?', (cache_key,)).fetchone()
+            if row is None or (self.cache_ttl is not None and row[1] < time.time() - self.cache_ttl):
+                return cache_key, None
+            return cache_key, json_loads(row[0])
+        except Exception as e:
+            self.logger.warning("Image understanding cache unavailable, calling API directly: %s", e)
+            return None, None
+
+    def _cache_store(self, cache_key, result):
+        """写入缓存，失败时只记录warning"""
+        try:
+            with self._cache_lock, self._cache_conn:
+                self._cache_conn.execute('INSERT OR REPLACE INTO results (key, result, created_at) VALUES (?, ?, ?)',
+                                         (cache_key, json_dumps(result), time.time()))
+        except Exception as e:
+            self.logger.warning("Failed to save image understanding result to cache: %s", e)
+
+    def _run_understanding(self, image_path, query):
+        """从空闲队列中取出一个API客户端，上传图片并调用应用API"""
+        api_client = self._idle_api_clients.get()
+        try:
+            # 上传时按http.client的小块读取文件，使用1MB缓冲减少read系统调用
+            with open(image_path, 'rb', buffering=1024 * 1024) as file:
                 self.logger.info('Preparing to upload file...')
-                conversation_id = self.api_client.create_conversation()
-                file_id, _ = self.api_client.upload_file(file)
+                conversation_id = api_client.create_conversation()
+                file_id, _ = api_client.upload_file(file)
 
             if file_id and conversation_id:
-                query = "按照要求理解图片内容并且进行输出"
-                result = self.api_client.run_app_api(query, file_id)
-                return result
+                return api_client.run_app_api(query, file_id)
+            return None
+        finally:
+            self._idle_api_clients.put(api_client)
+
+    def _understand_all(self, image_paths):
+        """
+        并发调用图片理解API
+        :param image_paths: {名称: 图片路径}
+        :return: {名称: API结果}，顺序与image_paths一致
+        """
+        if not image_paths:
+            return {}
+        max_workers = min(self.max_concurrent_understanding, len(image_paths))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(self._call_image_understanding, image_paths.values())
+            return dict(zip(image_paths, results))
+
+    def _call_image_understanding(self, image_path):
+        """调用图片理解API，内容相同的图片直接返回缓存的结果"""
+        try:
+            query = "按照要求理解图片内容并且进行输出"
+            cache_key = None
+            if self.use_cache:
+                cache_key, result = self._cache_lookup(image_path, query)
+                if result is not None:
+                    self.logger.info("Using cached image understanding result for %s", image_path)
+                    return result
+
+            result = self._run_understanding(image_path, query)
+            # 只缓存有效的结果，失败的调用下次仍会重新请求
+            if cache_key and result and 'answer' in result:
+                self._cache_store(cache_key, result)
+            return result
         except Exception as e:
-            self.logger.error("Error in image understanding: {}".format(str(e)))
+            self.logger.error("Error in image understanding: %s", e)
             return None
 
     def process_content(self, json_dict, save_path=None):
@@ -152,8 +478,8 @@ class ImageProcessor:
             image_links = current_dict.get(self.image_links_path[-1], {})
             
             if not image_links:
-                self.logger.warning("No image links found in JSON data at path: {}".format(
-                    ' -> '.join(self.image_links_path)))
+                self.logger.warning("No image links found in JSON data at path: %s",
+                    ' -> '.join(self.image_links_path))
                 return None
 
             # 下载图片
@@ -162,22 +488,22 @@ class ImageProcessor:
             
             # 处理内容
             org_content = json_dict.get('page_info', {}).get('content_text', '')
-            describe_string = '这是一张图片，通过markdown格式json语法代码块输出图片内容如下：'
             new_content = org_content
+            replacements = {}  # 图片标记名 -> 替换内容，所有图片处理完后统一替换
+
+            # 过小的图片在下载时已被过滤；并发调用图片理解，结果全部返回后再在当前线程中处理
+            for image_path in saved_files.values():
+                self.logger.info("Processing image: %s", image_path)
+            results = self._understand_all(saved_files)
 
             # 处理每张图片
-            for image_name, image_path in saved_files.items():
-                if os.path.getsize(image_path) < self.min_size_bytes:
-                    continue
-                
-                self.logger.info("Processing image: {}".format(image_path))
-                result = self._call_image_understanding(image_path)
+            for image_name, result in results.items():
                 if result and 'answer' in result:
                     answer = result['answer']
-                    match = re.search(r'```json(.*?)```', answer, re.DOTALL)
+                    match = _JSON_BLOCK_RE.search(answer)
                     if match:
                         try:
-                            answer_dict = json.loads(match.group(1))
+                            answer_dict = json_loads(match.group(1))
                             
                             # 有效性检查
                             should_process = True
@@ -191,15 +517,15 @@ class ImageProcessor:
                                 
                                 # 获取有效性标志并规范化处理
                                 valid_flag = answer_dict[self.valid_response_key]
-                                self.logger.info("Found validity flag: {} = {}".format(
-                                    self.valid_response_key, valid_flag))
+                                self.logger.info("Found validity flag: %s = %s",
+                                    self.valid_response_key, valid_flag)
                                 
                                 # 类型检查和值规范化
                                 if isinstance(valid_flag, str):
                                     valid_flag = valid_flag.lower() in ['true', 'yes', '1', 't', 'y']
-                                    self.logger.info("Converted string validity flag {}".format(valid_flag))
+                                    self.logger.info("Converted string validity flag %s", valid_flag)
                                 elif isinstance(valid_flag, bool):
-                                    self.logger.info("Validity flag is already boolean: {}".format(valid_flag))
+                                    self.logger.info("Validity flag is already boolean: %s", valid_flag)
                                 else:
                                     valid_flag = False
                                     self.logger.info("Invalid validity flag type, set to False")
@@ -207,34 +533,36 @@ class ImageProcessor:
                                 should_process = valid_flag
                             
                             if should_process:
-                                # 使用正则表达式替换图片标记
-                                pattern = r'\{\{' + re.escape(str(image_name)) + r'\}\}'
-                                replacement = describe_string + answer
-                                new_content = re.sub(pattern, replacement, new_content)
-                                self.logger.info("Replaced image {} with content description".format(image_name))
+                                replacements[str(image_name)] = _DESCRIBE_PREFIX + answer
+                                self.logger.info("Replaced image %s with content description", image_name)
                             else:
-                                self.logger.info("Skipped image {} due to validity check".format(image_name))
+                                self.logger.info("Skipped image %s due to validity check", image_name)
                                 
-                        except json.JSONDecodeError:
-                            self.logger.error("Failed to parse JSON from API response for image {}".format(image_name))
+                        except json.JSONDecodeError:  # orjson.JSONDecodeError是它的子类
+                            self.logger.error("Failed to parse JSON from API response for image %s", image_name)
                         except KeyError as e:
                             self.logger.error(str(e))
                             raise
                     else:
-                        self.logger.warning("No JSON content found in API response for image {}".format(image_name))
+                        self.logger.warning("No JSON content found in API response for image %s", image_name)
                 else:
-                    self.logger.warning("Invalid or empty API response for image {}".format(image_name))
+                    self.logger.warning("Invalid or empty API response for image %s", image_name)
+
+            # 所有图片标记合并为一个正则，只扫描一遍内容完成替换
+            if replacements:
+                pattern = re.compile(r'\{\{(' + '|'.join(re.escape(name) for name in replacements) + r')\}\}')
+                new_content = pattern.sub(lambda match: replacements[match.group(1)], org_content)
 
             # 保存结果
             if save_path:
                 with open(save_path, 'w', encoding='utf-8') as f:
                     f.write(new_content)
-                self.logger.info("Content saved to {}".format(save_path))
+                self.logger.info("Content saved to %s", save_path)
 
             return new_content
 
         except Exception as e:
-            self.logger.error("Error processing content: {}".format(str(e)))
+            self.logger.error("Error processing content: %s", e)
             return None
 
 class StrictImageProcessor(ImageProcessor):
@@ -247,7 +575,9 @@ class StrictImageProcessor(ImageProcessor):
     3. 优化字典遍历逻辑
     """
     def __init__(self, app_id, authorization, process_black_key=None, image_url_reg=None,
-                 recursive_depth=5, min_size_kb=30, valid_response_key=None):
+                 recursive_depth=5, min_size_kb=30, valid_response_key=None,
+                 image_save_dir=None, use_cache=False, cache_ttl=7 * 24 * 3600, cache_version='',
+                 download_workers=16, max_concurrent_understanding=8):
         """
         初始化
         :param app_id: 应用ID
@@ -257,20 +587,29 @@ class StrictImageProcessor(ImageProcessor):
         :param recursive_depth: 最大递归深度
         :param min_size_kb: 最小图片大小(KB)
         :param valid_response_key: API响应有效性检查键
+        :param image_save_dir: 临时图片和缓存的保存目录，如果为None则使用当前目录下的'images'文件夹
+        :param use_cache: 是否缓存图片理解结果，默认为False
+        :param cache_ttl: 缓存结果的有效期，单位为秒，默认为7天；为None时不过期
+        :param cache_version: 缓存版本号，更换后旧缓存失效
+        :param download_workers: 并发下载图片的最大线程数，默认为16
+        :param max_concurrent_understanding: 并发调用图片理解API的最大线程数，默认为8
         """
-        super().__init__(app_id, authorization)
+        super().__init__(app_id, authorization, image_save_dir=image_save_dir, use_cache=use_cache,
+                         cache_ttl=cache_ttl, cache_version=cache_version, download_workers=download_workers,
+                         max_concurrent_understanding=max_concurrent_understanding)
         self.process_black_key = process_black_key or []
+        self._black_set = frozenset(self.process_black_key)
         self.image_url_reg = re.compile(image_url_reg) if image_url_reg else None
         self.recursive_depth = recursive_depth
         self.min_size_bytes = min_size_kb * 1024
         self.valid_response_key = valid_response_key
         
-        self.logger.info("跳过黑名单key: {}".format(', '.join(self.process_black_key)))
+        self.logger.info("跳过黑名单key: %s", ', '.join(self.process_black_key))
         if self.valid_response_key:
-            self.logger.info("Validity check enabled with key: {}".format(self.valid_response_key))
+            self.logger.info("Validity check enabled with key: %s", self.valid_response_key)
         
         if self.image_url_reg:
-            self.logger.info("使用正则表达式: {}".format(self.image_url_reg))
+            self.logger.info("使用正则表达式: %s", self.image_url_reg)
 
     def _validate_url(self, url):
         """
@@ -279,78 +618,73 @@ class StrictImageProcessor(ImageProcessor):
         :return: bool
         """
         if not isinstance(url, str):
-            self.logger.debug("URL不是字符串类型: {}".format(type(url)))
+            self.logger.debug("URL不是字符串类型: %s", type(url))
             return False
             
         if not url:
             self.logger.debug("URL为空")
             return False
             
-        self.logger.debug("验证URL: {}".format(url))
-        self.logger.debug("使用正则表达式: {}".format(self.image_url_reg))
+        if not _looks_like_url(url):
+            self.logger.debug("不是URL格式的字符串")
+            return False
+
+        if self.image_url_reg is None:
+            # 未配置正则时不接受任何链接，避免把文档中的所有链接都下载并上传
+            return False
+            
+        self.logger.debug("验证URL: %s", url)
+        self.logger.debug("使用正则表达式: %s", self.image_url_reg)
         
-        match = re.search(self.image_url_reg, url)
+        match = self.image_url_reg.search(url)
         if match:
-            self.logger.debug("URL匹配成功: {}".format(match.group(0)))
+            self.logger.debug("URL匹配成功: %s", match.group(0))
             return True
         else:
             self.logger.debug("URL不匹配正则表达式")
             return False
 
-    def _traverse_dict(self, data, depth=0, parent_key=''):
+    def _iter_children(self, node, parent_path):
         """
-        递归遍历字典
-        :param data: 待遍历的数据
-        :param depth: 当前递归深度
-        :param parent_key: 父级key路径
-        :return: list of tuples (key_path, value)
+        按顺序产出字典/列表的直接子节点，跳过黑名单key
+        :return: 生成器，产出 (路径元组, value)，列表元素的路径以int下标表示
         """
-        if depth > self.recursive_depth:
-            self.logger.warning("达到最大递归深度{}".format(self.recursive_depth))
-            return []
-
-        results = []
-        self.logger.debug("当前递归深度: {}, 父级路径: {}".format(depth, parent_key))
-        self.logger.debug("当前数据类型: {}".format(type(data)))
-        
-        if isinstance(data, dict):
-            self.logger.debug("字典keys: {}".format(list(data.keys())))
-            for key, value in data.items():
-                if key in self.process_black_key:
-                    self.logger.info("跳过黑名单key: {}".format(key))
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key in self._black_set:
+                    self.logger.info("跳过黑名单key: %s", key)
                     continue
-                    
-                current_path = "{}.{}".format(parent_key, key) if parent_key else key
-                self.logger.debug("处理字典key: {}, 完整路径: {}".format(key, current_path))
-                
-                if isinstance(value, (dict, list)):
-                    self.logger.debug("发现嵌套结构 {}, 类型: {}".format(current_path, type(value)))
-                    results.extend(self._traverse_dict(value, depth + 1, current_path))
-                elif isinstance(value, str):
-                    self.logger.debug("发现字符串值: {} = {}...".format(current_path, value[:100]))
-                    results.append((current_path, value))
-                else:
-                    self.logger.debug("跳过非字符串值: {}, 类型: {}".format(current_path, type(value)))
-                    
-        elif isinstance(data, list):
-            self.logger.debug("列表长度: {}".format(len(data)))
-            for i, item in enumerate(data):
-                current_path = "{}[{}]".format(parent_key, i)
-                self.logger.debug("处理列表项 {}, 完整路径: {}".format(i, current_path))
-                
-                if isinstance(item, (dict, list)):
-                    self.logger.debug("发现嵌套结构 {}, 类型: {}".format(current_path, type(item)))
-                    results.extend(self._traverse_dict(item, depth + 1, current_path))
-                elif isinstance(item, str):
-                    self.logger.debug("发现字符串值: {} = {}...".format(current_path, item[:100]))
-                    results.append((current_path, item))
-                else:
-                    self.logger.debug("跳过非字符串值: {}, 类型: {}".format(current_path, type(item)))
+                yield parent_path + (key,), value
         else:
-            self.logger.debug("跳过非字典/列表数据: {}, 类型: {}".format(parent_key, type(data)))
-                    
-        self.logger.debug("当前层级({})找到的结果数: {}".format(depth, len(results)))
-        return results
+            for i, item in enumerate(node):
+                yield parent_path + (i,), item
+
+    def _iter_strings(self, data):
+        """
+        遍历字典，按文档顺序产出URL格式的字符串叶子节点
+        使用显式栈代替递归，不构建中间结果列表；正文等非URL字符串在遍历时直接跳过，不会进入正则匹配
+        :param data: 待遍历的数据
+        :return: 生成器，产出 (路径元组, value)，如(('foo', 'bar', 3), url)
+        """
+        if not isinstance(data, (dict, list)):
+            return
+
+        # 栈中保存每一层尚未遍历完的子节点迭代器及其深度
+        stack = [(self._iter_children(data, ()), 0)]
+        while stack:
+            children, depth = stack[-1]
+            for path, value in children:
+                if isinstance(value, str):
+                    if _looks_like_url(value):
+                        yield path, value
+                elif isinstance(value, (dict, list)):
+                    if depth + 1 > self.recursive_depth:
+                        self.logger.warning("达到最大递归深度%s", self.recursive_depth)
+                        continue
+                    stack.append((self._iter_children(value, path), depth + 1))
+                    break
+            else:
+                stack.pop()
 
     def process_content(self, json_dict, save_path=None):
         """
@@ -359,73 +693,75 @@ class StrictImageProcessor(ImageProcessor):
         :param save_path: 可选的保存路径
         :return: 处理后的内容或None（处理失败）
         """
+        if self.image_url_reg is None:
+            self.logger.error("未配置图片URL正则表达式(image_url_reg)，无法提取图片链接")
+            return None
+
         try:
-            # 遍历所有字段，获取URL和对应的路径
-            all_fields = self._traverse_dict(json_dict)
-            url_paths = {}  # 用于存储URL及其在字典中的路径
+            url_paths = defaultdict(list)  # URL -> 该URL在字典中出现的所有路径，同一URL只下载和处理一次
             
-            # 提取合规的图片链接
-            for path, value in all_fields:
+            # 遍历所有字段，提取合规的图片链接
+            for path, value in self._iter_strings(json_dict):
                 if self._validate_url(value):
-                    self.logger.info("找到合规图片链接: {} = {}".format(path, value))
-                    url_paths[value] = path
+                    if self.logger.isEnabledFor(logging.INFO):
+                        self.logger.info("找到合规图片链接: %s = %s", _format_path(path), value)
+                    url_paths[value].append(path)
                 
             if not url_paths:
                 self.logger.warning("未找到合规的图片链接")
                 return None
                 
+            # 并发下载所有图片
+            targets = {}
+            for url in url_paths:
+                # 用URL的sha256命名临时文件，hash()在每个进程中的结果都不同
+                url_hash = hashlib.sha256(url.encode('utf-8')).hexdigest()
+                targets[url] = (url, os.path.join(self.image_save_dir, "temp_{}".format(url_hash)))
+            downloaded = self._download_all(targets)
+
+            # 保存需要转换格式的图片，过小的图片在下载时已被过滤
+            eligible = {}
+            for url, (temp_path, buffer) in downloaded.items():
+                try:
+                    if buffer is not None:
+                        # 严格模式不做格式转换，原样保存
+                        with open(temp_path, 'wb') as f:
+                            shutil.copyfileobj(buffer, f)
+                    eligible[url] = temp_path
+                except Exception as e:
+                    self.logger.error("处理图片失败 %s: %s", url, e)
+
+            # 并发处理图片，处理完后删除临时文件
+            results = self._understand_all(eligible)
+            for temp_path in eligible.values():
+                os.remove(temp_path)
+                
             # 处理每个URL
-            for url, path in url_paths.items():
+            for url, result in results.items():
                 try:
-                    # 下载图片
-                    response = requests.get(url)
-                    response.raise_for_status()
-                    temp_path = os.path.join(self.image_save_dir, "temp_{}.jpg".format(hash(url)))
-                    
-                    with open(temp_path, 'wb') as f:
-                        f.write(response.content)
-                    
-                    # 检查文件大小
-                    if os.path.getsize(temp_path) < self.min_size_bytes:
-                        os.remove(temp_path)
-                        continue
-                    
-                    # 处理图片
-                    result = self._call_image_understanding(temp_path)
-                    os.remove(temp_path)  # 处理完后删除临时文件
-                    
                     if result and 'answer' in result:
                         answer = result['answer']
-                        # 直接替换URL为图片描述
-                        path_parts = path.split('.')
-                        current_dict = json_dict
-                        
-                        # 遍历路径到倒数第二个元素
-                        for part in path_parts[:-1]:
-                            current_dict = current_dict.get(part, {})
-                        
-                        # 设置最后一个元素的值
-                        last_part = path_parts[-1]
-                        current_dict[last_part] = answer
-                        self.logger.info("已替换URL的内容描述: {}".format(path))
+                        # 直接替换URL为图片描述，同一URL出现的所有位置都替换
+                        for path in url_paths[url]:
+                            _set_by_path(json_dict, path, answer)
+                            if self.logger.isEnabledFor(logging.INFO):
+                                self.logger.info("已替换URL的内容描述: %s", _format_path(path))
                     else:
-                        self.logger.warning("API响应无效或为空: {}".format(url))
+                        self.logger.warning("API响应无效或为空: %s", url)
                         
-                except requests.RequestException as e:
-                    self.logger.error("下载图片失败 {}: {}".format(url, str(e)))
                 except Exception as e:
-                    self.logger.error("处理图片失败 {}: {}".format(url, str(e)))
+                    self.logger.error("处理图片失败 %s: %s", url, e)
             
             # 保存结果
             if save_path:
-                with open(save_path, 'w', encoding='utf-8') as f:
-                    json.dump(json_dict, f, ensure_ascii=False, indent=2)
-                self.logger.info("内容已保存到 {}".format(save_path))
+                with open(save_path, 'wb') as f:
+                    f.write(json_dumps(json_dict, indent=True))
+                self.logger.info("内容已保存到 %s", save_path)
             
             return json_dict
             
         except Exception as e:
-            self.logger.error("处理内容时出错: {}".format(str(e)))
+            self.logger.error("处理内容时出错: %s", e)
             return None
 
 def main():
@@ -450,8 +786,8 @@ def main():
     
     # 读取示例JSON文件
     file_path = "appBuilder_api/test.json"
-    with open(file_path, 'r') as f:
-        json_dict = json.load(f)
+    with open(file_path, 'rb') as f:
+        json_dict = json_loads(f.read())
     
     # 处理内容并保存
     save_path = os.path.splitext(file_path)[0] + '_processed.txt'